@@ -7,23 +7,50 @@ All results return REAL product URLs — no Google redirects.
 uvicorn main:app --reload --port 8000
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+from cachetools import TTLCache
+import aiohttp
+import orjson
+import redis.asyncio as redis
 from typing import Optional
+from contextvars import ContextVar
 from urllib.parse import urlparse, parse_qs
 import asyncio
-import re
+import atexit
+import hashlib
+import string
 import time
 import traceback
 import logging
+import logging.handlers
 import os
-from datetime import datetime
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+import queue
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter
+
+# Log records go through a queue; a background thread does the actual stdout
+# writes so the event loop never blocks on the stream lock.
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # full layout is applied by the listener
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    handlers=[_log_queue_handler],
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger("hype")
 
-app = FastAPI(title="HYPE Intelligence API", version="5.0.0")
+app = FastAPI(title="HYPE Intelligence API", version="5.0.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,8 +59,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+SERPAPI_KEY = os.environ.get("SERPAPI_KEY", "")
+
+# Shared HTTP client — keeps SerpAPI connections + TLS sessions alive across searches
+_http_client = None
+
+# SerpAPI response cache — prices move on a minutes timescale, credits are scarce
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", "300"))
+
+# Optional Redis tier shared by all workers/instances (e.g. allkeys-lru)
+REDIS_URL = os.environ.get("REDIS_URL", "")
+_redis_client = None
+
+# In-process L1 in front of Redis; short-lived when Redis holds the shared copy
+SEARCH_CACHE_L1_TTL = int(os.environ.get("SEARCH_CACHE_L1_TTL", "60" if REDIS_URL else str(SEARCH_CACHE_TTL)))
+_search_cache = TTLCache(maxsize=10_000, ttl=SEARCH_CACHE_L1_TTL)
+_search_locks: dict[tuple, "_KeyLock"] = {}
+
+# Optional on-disk copy of SerpAPI responses, keyed by (params, day) — for local
+# development so repeat queries don't burn credits across restarts
+SERPAPI_DISK_CACHE_DIR = os.environ.get("SERPAPI_DISK_CACHE_DIR", "")
+
+# Per-request hit/miss counters, set by the search endpoint for its X-Cache header
+_cache_stats: ContextVar[Optional[dict]] = ContextVar("cache_stats", default=None)
 
-SERPAPI_KEY = os.environ.get("SERPAPI_KEY", "008f10fdf7243f76a522c290d21a1a13f19f16bb98c0a43bc22f836e9819ce15")
+# Outbound limits — every engine hits the same SerpAPI host
+SERPAPI_MAX_CONCURRENCY = int(os.environ.get("SERPAPI_MAX_CONCURRENCY", "8"))
+SERPAPI_MAX_RETRIES = int(os.environ.get("SERPAPI_MAX_RETRIES", "2"))
+_serpapi_semaphore = asyncio.Semaphore(SERPAPI_MAX_CONCURRENCY)
+_RETRY_STATUSES = {429, 503}
+# Upper bound on a decompressed SerpAPI body; normal responses are well under 1 MiB
+SERPAPI_MAX_RESPONSE_BYTES = int(os.environ.get("SERPAPI_MAX_RESPONSE_BYTES", str(8 * 1024 * 1024)))
 
 
 # ═══════════════════════════════════════════
@@ -41,6 +99,10 @@ SERPAPI_KEY = os.environ.get("SERPAPI_KEY", "008f10fdf7243f76a522c290d21a1a13f19
 # ═══════════════════════════════════════════
 
 class PriceResult(BaseModel):
+    # Built in bulk by the engine parsers via model_construct — they already
+    # coerce every field, so validation is skipped on that path.
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     platform: str
     platform_name: str
     product_name: str
@@ -69,36 +131,236 @@ class SearchResponse(BaseModel):
 #  SERPAPI HELPER
 # ═══════════════════════════════════════════
 
+def _get_http_client():
+    """Return the shared ClientSession, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.closed:
+        _http_client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=128, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+    return _http_client
+
+
+def _cache_key(params: dict) -> tuple:
+    return tuple(sorted(
+        (k, v.lower().strip() if isinstance(v, str) else v)
+        for k, v in params.items()
+        if k != "api_key"
+    ))
+
+
+def _get_redis():
+    """Return the shared Redis client, or None when REDIS_URL is unset."""
+    global _redis_client
+    if _redis_client is None and REDIS_URL:
+        _redis_client = redis.from_url(REDIS_URL, socket_timeout=1.0, socket_connect_timeout=1.0)
+    return _redis_client
+
+
+def _redis_key(key: tuple) -> str:
+    return "serpapi:" + hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+async def _redis_cache_get(key: tuple) -> Optional[dict]:
+    client = _get_redis()
+    if client is None:
+        return None
+    try:
+        raw = await client.get(_redis_key(key))
+        return orjson.loads(raw) if raw else None
+    except redis.RedisError as e:
+        logger.warning("[Redis] GET failed: %s", e)
+    except orjson.JSONDecodeError as e:
+        logger.warning("[Redis] Undecodable cache entry, ignoring: %s", e)
+    return None
+
+
+async def _redis_cache_put(key: tuple, data: dict) -> None:
+    client = _get_redis()
+    if client is None:
+        return
+    try:
+        await client.setex(_redis_key(key), SEARCH_CACHE_TTL, orjson.dumps(data))
+    except redis.RedisError as e:
+        logger.warning("[Redis] SETEX failed: %s", e)
+
+
+def _disk_cache_path(key: tuple) -> str:
+    digest = hashlib.blake2b(repr((date.today().isoformat(), key)).encode(), digest_size=16).hexdigest()
+    return os.path.join(SERPAPI_DISK_CACHE_DIR, f"{digest}.json")
+
+
+def _disk_cache_get(key: tuple) -> Optional[dict]:
+    try:
+        with open(_disk_cache_path(key), "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _disk_cache_put(key: tuple, data: dict) -> None:
+    path = _disk_cache_path(key)
+    try:
+        os.makedirs(SERPAPI_DISK_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(data))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("[SerpAPI] Disk cache write failed: %s", e)
+
+
+def _record_cache(hit: bool) -> None:
+    stats = _cache_stats.get()
+    if stats is not None:
+        stats["hits" if hit else "misses"] += 1
+
+
+class _KeyLock:
+    """Per-cache-key lock; dropped from _search_locks once nobody holds or awaits it."""
+
+    __slots__ = ("lock", "waiters", "result")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+        self.result: Optional[dict] = None  # last upstream result, shared with queued waiters
+
+
 async def serpapi_request(params: dict) -> dict:
-    """Single SerpAPI request with error handling."""
-    import httpx
-    params["api_key"] = SERPAPI_KEY
+    """
+    Cached SerpAPI request. Identical concurrent searches share one upstream
+    call (single-flight); only non-empty responses are cached, but a failed
+    (empty) fetch is still shared with the requests queued behind it rather
+    than retried by each of them in turn. Lookup order:
+    in-memory TTL cache → Redis (if REDIS_URL) → disk cache (if
+    SERPAPI_DISK_CACHE_DIR) → SerpAPI.
+    """
+    key = _cache_key(params)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        _record_cache(True)
+        return cached
+
+    entry = _search_locks.get(key)
+    if entry is None:
+        entry = _search_locks[key] = _KeyLock()
+    entry.waiters += 1
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get("https://serpapi.com/search.json", params=params)
-            if response.status_code != 200:
-                logger.error(f"[SerpAPI] HTTP {response.status_code}: {response.text[:200]}")
-                return {}
-            data = response.json()
-            if "error" in data:
-                logger.error(f"[SerpAPI] Error: {data['error']}")
-                return {}
+        async with entry.lock:
+            if entry.result is not None:
+                _record_cache(bool(entry.result))
+                return entry.result
+
+            data = _search_cache.get(key)
+            if data is None:
+                data = await _redis_cache_get(key)
+            if data is None and SERPAPI_DISK_CACHE_DIR:
+                data = await asyncio.to_thread(_disk_cache_get, key)
+            if data is not None:
+                _record_cache(True)
+                _search_cache[key] = data
+                return data
+
+            _record_cache(False)
+            data = entry.result = await _serpapi_fetch(params)
+            if data:
+                _search_cache[key] = data
+                await _redis_cache_put(key, data)
+                if SERPAPI_DISK_CACHE_DIR:
+                    await asyncio.to_thread(_disk_cache_put, key, data)
             return data
+    finally:
+        # Count-based, not lock.locked(): a released lock may still have
+        # queued waiters that haven't re-acquired it yet.
+        entry.waiters -= 1
+        if not entry.waiters:
+            del _search_locks[key]
+
+
+async def _read_capped(response: aiohttp.ClientResponse) -> Optional[bytes]:
+    """Read the (decompressed) body, or None once it exceeds SERPAPI_MAX_RESPONSE_BYTES."""
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(65536):
+        size += len(chunk)
+        if size > SERPAPI_MAX_RESPONSE_BYTES:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _serpapi_fetch(params: dict) -> dict:
+    """
+    Single SerpAPI request with error handling. Concurrency is capped by
+    _serpapi_semaphore; 429/503 responses are retried with exponential backoff.
+    """
+    params["api_key"] = SERPAPI_KEY
+    try:
+        client = _get_http_client()
+        for attempt in range(SERPAPI_MAX_RETRIES + 1):
+            async with _serpapi_semaphore:
+                async with client.get("https://serpapi.com/search.json", params=params) as response:
+                    status = response.status
+                    body = await _read_capped(response)
+                    if body is None:
+                        logger.error("[SerpAPI] Response over %d bytes, dropped", SERPAPI_MAX_RESPONSE_BYTES)
+                        return {}
+                    logger.debug("[SerpAPI] %d bytes, content-encoding=%s", len(body), response.headers.get("Content-Encoding"))
+            if status in _RETRY_STATUSES and attempt < SERPAPI_MAX_RETRIES:
+                delay = min(0.2 * 2 ** attempt, 2.0)
+                logger.warning("[SerpAPI] HTTP %s, retrying in %.1fs", status, delay)
+                await asyncio.sleep(delay)
+                continue
+            break
+        if status != 200:
+            logger.error("[SerpAPI] HTTP %s: %s", status, body[:200].decode(errors="replace"))
+            return {}
+        data = orjson.loads(body)
+        if "error" in data:
+            logger.error("[SerpAPI] Error: %s", data["error"])
+            return {}
+        return data
     except Exception as e:
-        logger.error(f"[SerpAPI] Request failed: {e}")
+        logger.error("[SerpAPI] Request failed: %s", e)
         return {}
 
 
+def _parse_results(label: str, items: list, max_results: int, parse_item, *args) -> list[PriceResult]:
+    """
+    Shared per-engine loop: run parse_item(item, *args) over the first
+    max_results raw items, dropping rejects (None) and logging parse errors.
+
+    Parsers check for malformed fields themselves (_safe_float etc.); the
+    try is only a backstop and costs nothing on the happy path (3.11+).
+    """
+    results = []
+    for item in items[:max_results]:
+        if not isinstance(item, dict):
+            continue
+        try:
+            result = parse_item(item, *args)
+        except Exception as e:
+            logger.warning("[%s] Parse error: %s", label, e)
+            continue
+        if result is not None:
+            results.append(result)
+
+    logger.info("[%s] Got %d results", label, len(results))
+    return results
+
+
 # ═══════════════════════════════════════════
 #  AMAZON (SerpAPI engine=amazon)
 # ═══════════════════════════════════════════
 
-async def search_amazon(query: str, max_results: int = 5) -> list[PriceResult]:
+async def search_amazon(query: str, max_results: int = 5, scraped_at: Optional[str] = None) -> list[PriceResult]:
     """
     SerpAPI Amazon Search — returns real Amazon product URLs.
     Response: organic_results[].link = "https://www.amazon.com/dp/B0..."
     """
-    logger.info(f"[Amazon] Searching: {query}")
+    logger.info("[Amazon] Searching: %s", query)
     data = await serpapi_request({
         "engine": "amazon",
         "k": query,
@@ -106,198 +368,200 @@ async def search_amazon(query: str, max_results: int = 5) -> list[PriceResult]:
         "language": "en_US",
     })
 
-    results = []
-    for item in data.get("organic_results", [])[:max_results]:
-        try:
-            name = item.get("title", "")
-            if not name or len(name) < 5:
-                continue
+    scraped_at = scraped_at or datetime.utcnow().isoformat()
+    return _parse_results("Amazon", data.get("organic_results", []), max_results, _parse_amazon_item, scraped_at)
 
-            # Skip sponsored
-            if item.get("sponsored"):
-                continue
 
-            # Price
-            price = None
-            if item.get("extracted_price") is not None:
-                price = float(item["extracted_price"])
-            elif item.get("price"):
-                price = _extract_any_price(item["price"])
-            if not price or price <= 0:
-                continue
+def _parse_amazon_item(item: dict, scraped_at: str) -> Optional[PriceResult]:
+    name = _str_or_none(item.get("title"))
+    if not name or len(name) < 5:
+        return None
 
-            # URL — real Amazon product page
-            url = item.get("link", "")
-            if not url:
-                continue
+    # Skip sponsored
+    if item.get("sponsored"):
+        return None
 
-            results.append(PriceResult(
-                platform="amazon",
-                platform_name="Amazon",
-                product_name=name,
-                price=price,
-                currency="$",
-                url=url,
-                seller="Amazon",
-                rating=_safe_float(item.get("rating")),
-                review_count=_safe_int(item.get("reviews")),
-                image_url=item.get("thumbnail"),
-                scraped_at=datetime.utcnow().isoformat(),
-                source="serpapi_amazon",
-            ))
-        except Exception as e:
-            logger.warning(f"[Amazon] Parse error: {e}")
-            continue
+    # Price
+    price = None
+    extracted = item.get("extracted_price")
+    if extracted is not None:
+        price = _safe_float(extracted)
+    elif item.get("price"):
+        price = _extract_any_price(item["price"])
+    if not price or price <= 0:
+        return None
 
-    logger.info(f"[Amazon] Got {len(results)} results")
-    return results
+    # URL — real Amazon product page
+    url = _str_or_none(item.get("link"))
+    if not url:
+        return None
+
+    return PriceResult.model_construct(
+        platform="amazon",
+        platform_name="Amazon",
+        product_name=name,
+        price=price,
+        currency="$",
+        url=url,
+        seller="Amazon",
+        rating=_safe_float(item.get("rating")),
+        review_count=_safe_int(item.get("reviews")),
+        image_url=_str_or_none(item.get("thumbnail")),
+        scraped_at=scraped_at,
+        source="serpapi_amazon",
+    )
 
 
 # ═══════════════════════════════════════════
 #  WALMART (SerpAPI engine=walmart)
 # ═══════════════════════════════════════════
 
-async def search_walmart(query: str, max_results: int = 5) -> list[PriceResult]:
+async def search_walmart(query: str, max_results: int = 5, scraped_at: Optional[str] = None) -> list[PriceResult]:
     """
     SerpAPI Walmart Search — returns real Walmart product URLs.
     Response: organic_results[].product_page_url = "https://www.walmart.com/ip/..."
     """
-    logger.info(f"[Walmart] Searching: {query}")
+    logger.info("[Walmart] Searching: %s", query)
     data = await serpapi_request({
         "engine": "walmart",
         "query": query,
     })
 
-    results = []
-    for item in data.get("organic_results", [])[:max_results]:
-        try:
-            name = item.get("title", "")
-            if not name or len(name) < 5:
-                continue
+    scraped_at = scraped_at or datetime.utcnow().isoformat()
+    return _parse_results("Walmart", data.get("organic_results", []), max_results, _parse_walmart_item, scraped_at)
 
-            # Sponsored check
-            if item.get("sponsored"):
-                continue
 
-            # Price
-            price = None
-            if item.get("primary_offer", {}).get("offer_price") is not None:
-                price = float(item["primary_offer"]["offer_price"])
-            elif item.get("price") is not None:
-                price = _extract_any_price(str(item["price"]))
-            if not price or price <= 0:
-                continue
+def _parse_walmart_item(item: dict, scraped_at: str) -> Optional[PriceResult]:
+    name = _str_or_none(item.get("title"))
+    if not name or len(name) < 5:
+        return None
 
-            # URL — real Walmart product page
-            url = item.get("product_page_url", "") or item.get("link", "")
-            if not url:
-                continue
-            # Ensure full URL
-            if url.startswith("/"):
-                url = f"https://www.walmart.com{url}"
-
-            results.append(PriceResult(
-                platform="walmart",
-                platform_name="Walmart",
-                product_name=name,
-                price=price,
-                currency="$",
-                url=url,
-                seller="Walmart",
-                rating=_safe_float(item.get("rating")),
-                review_count=_safe_int(item.get("reviews")),
-                image_url=item.get("thumbnail"),
-                scraped_at=datetime.utcnow().isoformat(),
-                source="serpapi_walmart",
-            ))
-        except Exception as e:
-            logger.warning(f"[Walmart] Parse error: {e}")
-            continue
+    # Sponsored check
+    if item.get("sponsored"):
+        return None
 
-    logger.info(f"[Walmart] Got {len(results)} results")
-    return results
+    # Price
+    price = None
+    offer = item.get("primary_offer")
+    offer_price = offer.get("offer_price") if isinstance(offer, dict) else None
+    if offer_price is not None:
+        price = _safe_float(offer_price)
+    elif item.get("price") is not None:
+        price = _extract_any_price(str(item["price"]))
+    if not price or price <= 0:
+        return None
+
+    # URL — real Walmart product page
+    url = _str_or_none(item.get("product_page_url")) or _str_or_none(item.get("link"))
+    if not url:
+        return None
+    # Ensure full URL
+    if url.startswith("/"):
+        url = f"https://www.walmart.com{url}"
+
+    return PriceResult.model_construct(
+        platform="walmart",
+        platform_name="Walmart",
+        product_name=name,
+        price=price,
+        currency="$",
+        url=url,
+        seller="Walmart",
+        rating=_safe_float(item.get("rating")),
+        review_count=_safe_int(item.get("reviews")),
+        image_url=_str_or_none(item.get("thumbnail")),
+        scraped_at=scraped_at,
+        source="serpapi_walmart",
+    )
 
 
 # ═══════════════════════════════════════════
 #  EBAY (SerpAPI engine=ebay)
 # ═══════════════════════════════════════════
 
-async def search_ebay(query: str, max_results: int = 5) -> list[PriceResult]:
+async def search_ebay(query: str, max_results: int = 5, scraped_at: Optional[str] = None) -> list[PriceResult]:
     """
     SerpAPI eBay Search — returns real eBay listing URLs.
     Response: organic_results[].link = "https://www.ebay.com/itm/..."
     """
-    logger.info(f"[eBay] Searching: {query}")
+    logger.info("[eBay] Searching: %s", query)
     data = await serpapi_request({
         "engine": "ebay",
         "_nkw": query,
         "ebay_domain": "ebay.com",
     })
 
-    results = []
-    for item in data.get("organic_results", [])[:max_results]:
-        try:
-            name = item.get("title", "")
-            if not name or len(name) < 5:
-                continue
+    scraped_at = scraped_at or datetime.utcnow().isoformat()
+    return _parse_results("eBay", data.get("organic_results", []), max_results, _parse_ebay_item, scraped_at)
 
-            # Price
-            price = None
-            if item.get("price"):
-                if isinstance(item["price"], dict):
-                    # eBay can return {"raw": "$25.99", "extracted": 25.99}
-                    price = _safe_float(item["price"].get("extracted"))
-                    if not price:
-                        price = _extract_any_price(item["price"].get("raw", ""))
-                else:
-                    price = _extract_any_price(str(item["price"]))
-            if not price or price <= 0:
-                continue
 
-            # URL — real eBay listing page
-            url = item.get("link", "")
-            if not url:
-                continue
+def _parse_ebay_item(item: dict, scraped_at: str) -> Optional[PriceResult]:
+    name = _str_or_none(item.get("title"))
+    if not name or len(name) < 5:
+        return None
 
-            results.append(PriceResult(
-                platform="ebay",
-                platform_name="eBay",
-                product_name=name,
-                price=price,
-                currency="$",
-                url=url,
-                seller=item.get("seller", {}).get("name", "eBay Seller") if isinstance(item.get("seller"), dict) else "eBay",
-                rating=_safe_float(item.get("reviews", {}).get("rating")) if isinstance(item.get("reviews"), dict) else None,
-                review_count=_safe_int(item.get("reviews", {}).get("count")) if isinstance(item.get("reviews"), dict) else None,
-                image_url=item.get("thumbnail"),
-                scraped_at=datetime.utcnow().isoformat(),
-                source="serpapi_ebay",
-            ))
-        except Exception as e:
-            logger.warning(f"[eBay] Parse error: {e}")
-            continue
+    # Price
+    price = None
+    raw_price = item.get("price")
+    if raw_price:
+        if isinstance(raw_price, dict):
+            # eBay can return {"raw": "$25.99", "extracted": 25.99}
+            price = _safe_float(raw_price.get("extracted"))
+            if not price:
+                price = _extract_any_price(raw_price.get("raw", ""))
+        else:
+            price = _extract_any_price(str(raw_price))
+    if not price or price <= 0:
+        return None
 
-    logger.info(f"[eBay] Got {len(results)} results")
-    return results
+    # URL — real eBay listing page
+    url = _str_or_none(item.get("link"))
+    if not url:
+        return None
+
+    # Seller / reviews — looked up once, may be dicts or plain values
+    seller = item.get("seller")
+    reviews = item.get("reviews")
+    if not isinstance(reviews, dict):
+        reviews = None
+
+    return PriceResult.model_construct(
+        platform="ebay",
+        platform_name="eBay",
+        product_name=name,
+        price=price,
+        currency="$",
+        url=url,
+        seller=_str_or_none(seller.get("name", "eBay Seller")) if isinstance(seller, dict) else "eBay",
+        rating=_safe_float(reviews.get("rating")) if reviews else None,
+        review_count=_safe_int(reviews.get("count")) if reviews else None,
+        image_url=_str_or_none(item.get("thumbnail")),
+        scraped_at=scraped_at,
+        source="serpapi_ebay",
+    )
 
 
 # ═══════════════════════════════════════════
 #  GOOGLE SHOPPING (SerpAPI engine=google_shopping)
 # ═══════════════════════════════════════════
 
-async def search_google_shopping(query: str, region: str = "us", max_results: int = 5) -> list[PriceResult]:
+_GOOGLE_SHOPPING_REGIONS = {
+    "us": {"gl": "us", "hl": "en", "currency": "$", "location": "United States"},
+    "eu": {"gl": "de", "hl": "de", "currency": "€", "location": "Germany"},
+    "tr": {"gl": "tr", "hl": "tr", "currency": "₺", "location": "Turkey"},
+}
+
+
+async def search_google_shopping(
+    query: str, region: str = "us", max_results: int = 5, scraped_at: Optional[str] = None,
+) -> list[PriceResult]:
     """
     SerpAPI Google Shopping — aggregator results from many stores.
     URLs are Google redirects, so we extract real URLs where possible.
     """
-    config = {
-        "us": {"gl": "us", "hl": "en", "currency": "$", "location": "United States"},
-        "eu": {"gl": "de", "hl": "de", "currency": "€", "location": "Germany"},
-        "tr": {"gl": "tr", "hl": "tr", "currency": "₺", "location": "Turkey"},
-    }
-    cfg = config.get(region, config["us"])
+    cfg = _GOOGLE_SHOPPING_REGIONS.get(region, _GOOGLE_SHOPPING_REGIONS["us"])
 
-    logger.info(f"[Google Shopping] Searching: {query} | region={region}")
+    logger.info("[Google Shopping] Searching: %s | region=%s", query, region)
     data = await serpapi_request({
         "engine": "google_shopping",
         "q": query,
@@ -307,86 +571,114 @@ async def search_google_shopping(query: str, region: str = "us", max_results: in
         "num": max_results,
     })
 
-    results = []
-    for item in data.get("shopping_results", [])[:max_results]:
-        try:
-            name = item.get("title", "")
-            if not name:
-                continue
+    scraped_at = scraped_at or datetime.utcnow().isoformat()
+    return _parse_results(
+        "Google Shopping", data.get("shopping_results", []), max_results,
+        _parse_google_shopping_item, scraped_at, region, cfg["currency"],
+    )
 
-            # Price
-            price = None
-            if item.get("extracted_price") is not None:
-                price = float(item["extracted_price"])
-            else:
-                price = _extract_any_price(item.get("price", ""))
-            if not price or price <= 0:
-                continue
 
-            # Seller
-            seller = item.get("source", "") or item.get("seller", "")
-            platform_id, platform_name = _identify_platform(seller, region)
-
-            # URL — try to extract real URL from Google redirect
-            raw_url = item.get("link") or item.get("product_link") or ""
-            url = _extract_real_url(raw_url)
-
-            results.append(PriceResult(
-                platform=platform_id,
-                platform_name=platform_name,
-                product_name=name,
-                price=price,
-                currency=cfg["currency"],
-                url=url,
-                seller=seller,
-                rating=_safe_float(item.get("rating")),
-                review_count=_safe_int(item.get("reviews")),
-                image_url=item.get("thumbnail") or item.get("image"),
-                scraped_at=datetime.utcnow().isoformat(),
-                source="serpapi_google_shopping",
-            ))
-        except Exception as e:
-            logger.warning(f"[Google Shopping] Parse error: {e}")
-            continue
+def _parse_google_shopping_item(item: dict, scraped_at: str, region: str, currency: str) -> Optional[PriceResult]:
+    name = _str_or_none(item.get("title"))
+    if not name:
+        return None
 
-    logger.info(f"[Google Shopping] Got {len(results)} results")
-    return results
+    # Price
+    price = None
+    extracted = item.get("extracted_price")
+    if extracted is not None:
+        price = _safe_float(extracted)
+    else:
+        price = _extract_any_price(item.get("price", ""))
+    if not price or price <= 0:
+        return None
+
+    # Seller
+    seller = _str_or_none(item.get("source")) or _str_or_none(item.get("seller")) or ""
+    platform_id, platform_name = _identify_platform(seller, region)
+
+    # URL — try to extract real URL from Google redirect
+    raw_url = _str_or_none(item.get("link")) or _str_or_none(item.get("product_link")) or ""
+    url = _extract_real_url(raw_url)
+
+    return PriceResult.model_construct(
+        platform=platform_id,
+        platform_name=platform_name,
+        product_name=name,
+        price=price,
+        currency=currency,
+        url=url,
+        seller=seller,
+        rating=_safe_float(item.get("rating")),
+        review_count=_safe_int(item.get("reviews")),
+        image_url=_str_or_none(item.get("thumbnail")) or _str_or_none(item.get("image")),
+        scraped_at=scraped_at,
+        source="serpapi_google_shopping",
+    )
 
 
 # ═══════════════════════════════════════════
 #  UTILS
 # ═══════════════════════════════════════════
 
+class _KeepChars(dict):
+    """
+    str.translate table that deletes every character not in `keep` (or, with
+    keep_decimal, not a Unicode decimal digit — what \\d matches in re).
+    """
+
+    def __init__(self, keep: str, keep_decimal: bool = False):
+        super().__init__((ord(c), ord(c)) for c in keep)
+        self.keep_decimal = keep_decimal
+
+    def __missing__(self, key):
+        value = key if self.keep_decimal and chr(key).isdecimal() else None
+        self[key] = value
+        return value
+
+
+_PRICE_CHARS = _KeepChars(".,", keep_decimal=True)  # float() accepts any decimal digit
+_EU_DECIMAL = str.maketrans({'.': None, ',': '.'})  # "1.234,56" -> "1234.56"
+_NAME_KEY_CHARS = _KeepChars(string.ascii_lowercase + string.digits)
+
+
 def _extract_any_price(text) -> Optional[float]:
     """Extract price from any format."""
     if not text:
         return None
-    cleaned = re.sub(r'[^\d.,]', '', str(text).strip())
+    cleaned = str(text).translate(_PRICE_CHARS)
     if not cleaned:
         return None
+    # Last separator decides the decimal mark: "1,234.50" vs "1.234,50";
+    # a lone comma is decimal only with exactly two digits after it ("12,50").
+    dot = cleaned.rfind('.')
+    comma = cleaned.rfind(',')
     try:
-        if '.' in cleaned and ',' in cleaned:
-            if cleaned.rindex('.') > cleaned.rindex(','):
+        if comma >= 0:
+            if dot > comma:
                 cleaned = cleaned.replace(',', '')
-            else:
-                cleaned = cleaned.replace('.', '').replace(',', '.')
-        elif ',' in cleaned:
-            parts = cleaned.split(',')
-            if len(parts[-1]) == 2:
+            elif dot >= 0:
+                cleaned = cleaned.translate(_EU_DECIMAL)
+            elif len(cleaned) - comma == 3:
                 cleaned = cleaned.replace(',', '.')
             else:
                 cleaned = cleaned.replace(',', '')
         return float(cleaned)
-    except:
+    except ValueError:
         return None
 
 
+def _str_or_none(val) -> Optional[str]:
+    """model_construct skips validation, so str fields are type-checked here."""
+    return val if isinstance(val, str) else None
+
+
 def _safe_float(val) -> Optional[float]:
     if val is None:
         return None
     try:
         return float(val)
-    except:
+    except (TypeError, ValueError):
         return None
 
 
@@ -395,7 +687,7 @@ def _safe_int(val) -> Optional[int]:
         return None
     try:
         return int(val)
-    except:
+    except (TypeError, ValueError, OverflowError):
         return None
 
 
@@ -413,37 +705,40 @@ def _extract_real_url(raw_url: str) -> str:
                 candidate = params[key][0]
                 if candidate.startswith("http"):
                     return candidate
-    except:
+    except ValueError:
         pass
     return raw_url
 
 
+_PLATFORM_MAPPINGS = {
+    "amazon": ("amazon", "Amazon"),
+    "walmart": ("walmart", "Walmart"),
+    "best buy": ("bestbuy", "Best Buy"),
+    "bestbuy": ("bestbuy", "Best Buy"),
+    "target": ("target", "Target"),
+    "ebay": ("ebay", "eBay"),
+    "newegg": ("newegg", "Newegg"),
+    "b&h": ("bh", "B&H Photo"),
+    "apple": ("apple", "Apple"),
+    "nike": ("nike", "Nike"),
+    "adidas": ("adidas", "Adidas"),
+    "trendyol": ("trendyol", "Trendyol"),
+    "hepsiburada": ("hepsiburada", "Hepsiburada"),
+    "n11": ("n11", "n11"),
+    "mediamarkt": ("mediamarkt", "MediaMarkt"),
+    "saturn": ("saturn", "Saturn"),
+    "coolblue": ("coolblue", "Coolblue"),
+    "fnac": ("fnac", "Fnac"),
+    "otto": ("otto", "Otto"),
+}
+
+
+@lru_cache(maxsize=2048)
 def _identify_platform(seller: str, region: str) -> tuple[str, str]:
     if not seller:
         return "unknown", "Unknown"
     s = seller.lower()
-    mappings = {
-        "amazon": ("amazon", "Amazon"),
-        "walmart": ("walmart", "Walmart"),
-        "best buy": ("bestbuy", "Best Buy"),
-        "bestbuy": ("bestbuy", "Best Buy"),
-        "target": ("target", "Target"),
-        "ebay": ("ebay", "eBay"),
-        "newegg": ("newegg", "Newegg"),
-        "b&h": ("bh", "B&H Photo"),
-        "apple": ("apple", "Apple"),
-        "nike": ("nike", "Nike"),
-        "adidas": ("adidas", "Adidas"),
-        "trendyol": ("trendyol", "Trendyol"),
-        "hepsiburada": ("hepsiburada", "Hepsiburada"),
-        "n11": ("n11", "n11"),
-        "mediamarkt": ("mediamarkt", "MediaMarkt"),
-        "saturn": ("saturn", "Saturn"),
-        "coolblue": ("coolblue", "Coolblue"),
-        "fnac": ("fnac", "Fnac"),
-        "otto": ("otto", "Otto"),
-    }
-    for key, (pid, pname) in mappings.items():
+    for key, (pid, pname) in _PLATFORM_MAPPINGS.items():
         if key in s:
             return pid, pname
     return "other", seller
@@ -461,25 +756,27 @@ async def search_region(query: str, region: str, max_results: int = 15):
     TR: Google Shopping (1 credit)
     """
     per_engine = max(3, max_results // 4)
+    # One timestamp for the whole search, shared by every engine's results
+    scraped_at = datetime.utcnow().isoformat()
 
     if region == "us":
         tasks = [
-            search_amazon(query, per_engine),
-            search_walmart(query, per_engine),
-            search_ebay(query, per_engine),
-            search_google_shopping(query, "us", per_engine),
+            search_amazon(query, per_engine, scraped_at),
+            search_walmart(query, per_engine, scraped_at),
+            search_ebay(query, per_engine, scraped_at),
+            search_google_shopping(query, "us", per_engine, scraped_at),
         ]
         sources = ["amazon", "walmart", "ebay", "google_shopping"]
 
     elif region == "eu":
         tasks = [
-            search_google_shopping(query, "eu", max_results),
+            search_google_shopping(query, "eu", max_results, scraped_at),
         ]
         sources = ["google_shopping_eu"]
 
     elif region == "tr":
         tasks = [
-            search_google_shopping(query, "tr", max_results),
+            search_google_shopping(query, "tr", max_results, scraped_at),
         ]
         sources = ["google_shopping_tr"]
 
@@ -488,34 +785,54 @@ async def search_region(query: str, region: str, max_results: int = 15):
 
     results_nested = await asyncio.gather(*tasks, return_exceptions=True)
 
-    all_results = []
+    engine_results = []
     active_sources = []
     for i, r in enumerate(results_nested):
         if isinstance(r, Exception):
-            logger.error(f"Search error [{sources[i]}]: {r}")
+            logger.error("Search error [%s]: %s", sources[i], r)
             continue
         if r:
-            all_results.extend(r)
+            engine_results.append(r)
             active_sources.append(sources[i])
 
-    # Deduplicate by normalized product name
+    # Walk candidates cheapest-first, deduplicating by normalized product name,
+    # and stop as soon as max_results are kept (the rest are never normalized)
     seen = set()
     unique = []
-    for r in all_results:
-        key = re.sub(r'[^a-z0-9]', '', r.product_name.lower())[:60]
-        if key not in seen:
-            seen.add(key)
-            unique.append(r)
+    for r in sorted(chain.from_iterable(engine_results), key=attrgetter("price")):
+        key = r.product_name.lower().translate(_NAME_KEY_CHARS)[:60]
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(r)
+        if len(unique) >= max_results:
+            break
 
-    # Sort by price
-    unique.sort(key=lambda x: x.price)
-    return unique[:max_results], active_sources
+    return unique, active_sources
 
 
 # ═══════════════════════════════════════════
 #  API ENDPOINTS
 # ═══════════════════════════════════════════
 
+@app.on_event("startup")
+async def startup():
+    if not SERPAPI_KEY:
+        logger.warning("SERPAPI_KEY is not set; every search will return no results")
+    _get_http_client()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    global _http_client, _redis_client
+    if _http_client is not None:
+        await _http_client.close()
+        _http_client = None
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
+
+
 @app.get("/")
 async def root():
     return {
@@ -532,6 +849,7 @@ async def root():
 
 @app.get("/api/search", response_model=SearchResponse)
 async def search_products(
+    response: Response,
     q: str = Query(..., min_length=1),
     region: str = Query("us"),
     max_results: int = Query(15, ge=1, le=30),
@@ -539,10 +857,16 @@ async def search_products(
     if region not in ["us", "tr", "eu"]:
         raise HTTPException(400, "Unsupported region. Use: us, tr, eu")
 
+    stats = {"hits": 0, "misses": 0}
+    _cache_stats.set(stats)
+
     start = time.time()
     results, sources = await search_region(q, region, max_results)
     elapsed = int((time.time() - start) * 1000)
-    platforms_found = list(set(r.platform for r in results))
+    response.headers["X-Cache"] = (
+        "MISS" if not stats["hits"] else "HIT" if not stats["misses"] else "PARTIAL"
+    )
+    platforms_found = list(dict.fromkeys(r.platform for r in results))
 
     return SearchResponse(
         query=q,
@@ -570,9 +894,13 @@ async def debug_search(
         "google_shopping": search_google_shopping(q, region, 3),
     }
 
-    for name, coro in engines.items():
-        try:
-            results = await coro
+    # Run all engines concurrently, like search_region does
+    outcomes = await asyncio.gather(*engines.values(), return_exceptions=True)
+
+    for name, results in zip(engines, outcomes):
+        if isinstance(results, Exception):
+            debug_info["errors"][name] = f"{type(results).__name__}: {str(results)}"
+        else:
             debug_info["engines"][name] = {
                 "count": len(results),
                 "items": [
@@ -586,8 +914,6 @@ async def debug_search(
                     for r in results
                 ],
             }
-        except Exception as e:
-            debug_info["errors"][name] = f"{type(e).__name__}: {str(e)}"
 
     return debug_info
 
@@ -618,4 +944,11 @@ async def credits_info():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", max(2, (os.cpu_count() or 2) // 2))),
+    )